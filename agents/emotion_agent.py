@@ -1,194 +1,500 @@
-"""
-Emotion Detection Agent - Accurate Emotion Classifier
-Detects emotions from text using a reliable model.
-"""
-
-from transformers import AutoTokenizer, AutoModelForSequenceClassification
-import torch
-import numpy as np
-
-
-class EmotionAgent:
-    """
-    Emotion Detection Agent that accurately classifies emotions from text.
-    """
-    
-   
-    EMOTIONS = ['happiness', 'sadness', 'anger', 'anxiety', 'frustration', 'depression']
-    
-    def __init__(self):
-        """Initialize the emotion detection agent."""
-        print("Initializing Emotion Detection Agent...")
-        
-        self.device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
-        print(f"Using device: {self.device}")
-        
-    
-        model_name = 'j-hartmann/emotion-english-distilroberta-base'
-        print(f"Loading {model_name}...")
-        
-        self.tokenizer = AutoTokenizer.from_pretrained(model_name)
-        self.model = AutoModelForSequenceClassification.from_pretrained(model_name)
-        self.model.to(self.device)
-        self.model.eval()
-        
-    
-        self.model_labels = ['joy', 'sadness', 'anger', 'fear', 'surprise', 'disgust']
-        
-        print("Emotion Detection Agent initialized!")
-    
-    def predict_emotion(self, text: str) -> tuple:
-        """
-        Predict emotion from text with improved accuracy.
-        Returns top emotion and confidence.
-        
-        Args:
-            text: Input text string
-            
-        Returns:
-            tuple: (emotion_label, confidence_score)
-        """
-        all_probs = self.get_all_probabilities(text)
-        emotion_label = max(all_probs, key=all_probs.get)
-        confidence_score = all_probs[emotion_label]
-        return emotion_label, confidence_score
-    
-    def get_top_emotions(self, text: str, top_n: int = 3) -> list:
-        """
-        Get top N emotions with their probabilities.
-        
-        Args:
-            text: Input text string
-            top_n: Number of top emotions to return
-            
-        Returns:
-            List of tuples: [(emotion, probability), ...] sorted by probability
-        """
-        all_probs = self.get_all_probabilities(text)
-        sorted_emotions = sorted(all_probs.items(), key=lambda x: x[1], reverse=True)
-        return sorted_emotions[:top_n]
-    
-    def _map_emotion(self, model_emotion: str, text: str) -> str:
-        """Map model emotion to standard emotion, considering text context."""
-        text_lower = text.lower()
-        emotion_lower = model_emotion.lower()
-        
-        # Check for frustration indicators
-        frustration_keywords = [
-            'tired of', 'sick of', 'fed up', 'frustrat', 'stuck', 'can\'t', 
-            'cannot', 'difficult', 'hard', 'struggl', 'overwhelm', 'too much',
-            'assignment', 'homework', 'work', 'deadline', 'pressure'
-        ]
-        if any(keyword in text_lower for keyword in frustration_keywords):
-            return 'frustration'
-        
-        # Check for depression indicators
-        depression_keywords = [
-            'depress', 'hopeless', 'worthless', 'empty', 'numb', 'nothing matters',
-            'no point', 'give up', 'suicide', 'end it'
-        ]
-        if any(keyword in text_lower for keyword in depression_keywords):
-            return 'depression'
-        
-        # Check for anxiety indicators
-        anxiety_keywords = [
-            'anxious', 'worried', 'nervous', 'panic', 'scared', 'afraid', 
-            'fear', 'stress', 'stressed', 'overthink'
-        ]
-        if any(keyword in text_lower for keyword in anxiety_keywords):
-            return 'anxiety'
-        
-        # Check for sadness indicators
-        sadness_keywords = [
-            'sad', 'unhappy', 'down', 'cry', 'crying', 'lonely', 'alone',
-            'miss', 'hurt', 'pain', 'grief', 'loss'
-        ]
-        if any(keyword in text_lower for keyword in sadness_keywords):
-            return 'sadness'
-        
-        # Check for happiness indicators
-        happiness_keywords = [
-            'happy', 'glad', 'excited', 'great', 'wonderful', 'amazing',
-            'love', 'joy', 'pleased', 'delighted', 'thrilled'
-        ]
-        if any(keyword in text_lower for keyword in happiness_keywords):
-            return 'happiness'
-        
-        # Check for anger indicators (more specific)
-        anger_keywords = [
-            'angry', 'mad', 'furious', 'rage', 'hate', 'disgust', 'annoyed',
-            'pissed', 'irritated', 'livid'
-        ]
-        if any(keyword in text_lower for keyword in anger_keywords):
-            return 'anger'
-        
-        # Then map model emotions (fallback)
-        if emotion_lower == 'joy':
-            return 'happiness'
-        elif emotion_lower == 'sadness':
-            return 'sadness'
-        elif emotion_lower == 'anger':
-            # If no clear context, check if it might be frustration
-            if any(word in text_lower for word in ['tired', 'sick of', 'fed up']):
-                return 'frustration'
-            return 'anger'
-        elif emotion_lower == 'fear':
-            return 'anxiety'
-        elif emotion_lower == 'surprise':
-            if any(word in text_lower for word in ['happy', 'glad', 'excited', 'great']):
-                return 'happiness'
-            else:
-                return 'anxiety'
-        elif emotion_lower == 'disgust':
-            return 'anger'
-        
-        return 'sadness'  # Default
-    
-    def get_all_probabilities(self, text: str) -> dict:
-        """Get probability scores for all emotions with improved accuracy."""
-        if not text or not text.strip():
-            raise ValueError("Text cannot be empty")
-        
-        # Tokenize and predict
-        inputs = self.tokenizer(
-            text,
-            return_tensors="pt",
-            truncation=True,
-            max_length=512,
-            padding=True
-        ).to(self.device)
-        
-        with torch.no_grad():
-            outputs = self.model(**inputs)
-            probabilities = torch.softmax(outputs.logits, dim=1)
-        
-        # Get all predictions
-        probs_list = probabilities[0].tolist()
-        
-        # Map model emotions to our standard emotions with context
-        emotion_scores = {}
-        for i, prob_value in enumerate(probs_list):
-            if i < len(self.model_labels):
-                model_emotion = self.model_labels[i]
-                
-                # Map to standard emotion (with context awareness)
-                standard_emotion = self._map_emotion(model_emotion, text)
-                if standard_emotion not in emotion_scores:
-                    emotion_scores[standard_emotion] = []
-                emotion_scores[standard_emotion].append(prob_value)
-        
-        # Average scores for each emotion
-        final_scores = {emotion: np.mean(scores) for emotion, scores in emotion_scores.items()}
-        
-        # Ensure all emotions are present
-        for emotion in self.EMOTIONS:
-            if emotion not in final_scores:
-                final_scores[emotion] = 0.0
-        
-        # Normalize
-        total = sum(final_scores.values())
-        if total > 0:
-            final_scores = {k: v / total for k, v in final_scores.items()}
-        
-        return final_scores
-
+"""
+Emotion Detection Agent - Accurate Emotion Classifier
+Detects emotions from text using a reliable model.
+"""
+
+from transformers import AutoTokenizer, AutoModelForSequenceClassification
+import torch
+import numpy as np
+import functools
+import os
+import re
+
+# Optional: ONNX Runtime backend (via optimum) for fast INT8 CPU inference
+try:
+    import onnxruntime as ort
+    from optimum.onnxruntime import ORTModelForSequenceClassification, ORTQuantizer
+    from optimum.onnxruntime.configuration import AutoQuantizationConfig
+    ONNX_AVAILABLE = True
+except ImportError:
+    ONNX_AVAILABLE = False
+
+# Optional: Intel extension for the oneDNN BF16 fastpath on newer Xeons
+try:
+    import intel_extension_for_pytorch as ipex
+    IPEX_AVAILABLE = True
+except ImportError:
+    IPEX_AVAILABLE = False
+
+
+# Context keyword buckets, checked in priority order. Each bucket is compiled
+# into a single alternation regex so detection is one linear scan over the
+# text instead of ~10 separate substring searches per bucket.
+_CONTEXT_KEYWORDS = [
+    ('frustration', [
+        'tired of', 'sick of', 'fed up', 'frustrat', 'stuck', 'can\'t',
+        'cannot', 'difficult', 'hard', 'struggl', 'overwhelm', 'too much',
+        'assignment', 'homework', 'work', 'deadline', 'pressure'
+    ]),
+    ('depression', [
+        'depress', 'hopeless', 'worthless', 'empty', 'numb', 'nothing matters',
+        'no point', 'give up', 'suicide', 'end it'
+    ]),
+    ('anxiety', [
+        'anxious', 'worried', 'nervous', 'panic', 'scared', 'afraid',
+        'fear', 'stress', 'stressed', 'overthink'
+    ]),
+    ('sadness', [
+        'sad', 'unhappy', 'down', 'cry', 'crying', 'lonely', 'alone',
+        'miss', 'hurt', 'pain', 'grief', 'loss'
+    ]),
+    ('happiness', [
+        'happy', 'glad', 'excited', 'great', 'wonderful', 'amazing',
+        'love', 'joy', 'pleased', 'delighted', 'thrilled'
+    ]),
+    ('anger', [
+        'angry', 'mad', 'furious', 'rage', 'hate', 'disgust', 'annoyed',
+        'pissed', 'irritated', 'livid'
+    ]),
+]
+
+_CONTEXT_PATTERNS = [
+    (emotion, re.compile('|'.join(map(re.escape, keywords))))
+    for emotion, keywords in _CONTEXT_KEYWORDS
+]
+
+# Secondary check used only in the model-label fallback path
+_ANGER_AS_FRUSTRATION = re.compile('tired|sick of|fed up')
+
+# "Confidence-1" anchors per bucket: words explicit enough that once their
+# bucket wins context detection, the model forward adds nothing (a context
+# match already collapses the output to that emotion).
+_FAST_PATH_ANCHORS = {
+    'frustration': re.compile('fed up|frustrat'),
+    'depression': re.compile('depress|hopeless|worthless|suicide'),
+    'anxiety': re.compile('anxious|panic'),
+    'sadness': re.compile('crying|grief|heartbroken'),
+    'happiness': re.compile('happy|delighted|thrilled'),
+    'anger': re.compile('furious|livid'),
+}
+
+
+class EmotionAgent:
+    """
+    Emotion Detection Agent that accurately classifies emotions from text.
+    """
+
+
+    EMOTIONS = ['happiness', 'sadness', 'anger', 'anxiety', 'frustration', 'depression']
+
+    def __init__(self, use_onnx=None, use_int8=None, cache_size=4096):
+        """
+        Initialize the emotion detection agent.
+
+        Args:
+            use_onnx: Use the INT8-quantized ONNX Runtime backend (CPU).
+                      Defaults to auto: enabled on CPU when optimum/onnxruntime
+                      are installed, disabled on GPU (torch path is faster there).
+            use_int8: Apply torch dynamic INT8 quantization on the torch CPU
+                      path (irrelevant when the ONNX backend is active, which
+                      is already INT8). Defaults to auto: enabled on CPU.
+            cache_size: Max entries in the memoized inference cache (0 disables).
+        """
+        print("Initializing Emotion Detection Agent...")
+
+        self.device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+        print(f"Using device: {self.device}")
+
+        # Decide backend: ONNX INT8 on CPU (if available), PyTorch otherwise
+        if use_onnx is None:
+            use_onnx = ONNX_AVAILABLE and self.device.type == 'cpu'
+        self.use_onnx = use_onnx and ONNX_AVAILABLE
+
+
+        model_name = 'j-hartmann/emotion-english-distilroberta-base'
+        print(f"Loading {model_name}...")
+
+        # Pre-download only safetensors weights (plus tokenizer/config files):
+        # safetensors mmap without the 2x peak RAM of pickle .bin loading
+        try:
+            from huggingface_hub import snapshot_download
+            snapshot_download(
+                model_name,
+                allow_patterns=['*.safetensors', 'tokenizer*', 'config*', '*.json', '*.txt']
+            )
+        except Exception:
+            pass  # offline or hub unreachable; from_pretrained fetches as usual
+
+        # The Rust-backed fast tokenizer is 2-5x quicker than the Python one
+        self.tokenizer = AutoTokenizer.from_pretrained(model_name, use_fast=True)
+        if not self.tokenizer.is_fast:
+            print("Warning: fast tokenizer unavailable, falling back to the slow one")
+
+        if self.use_onnx:
+            self.model = self._load_onnx_model(model_name)
+            print("Using ONNX Runtime backend (INT8 dynamic quantization)")
+        else:
+            self.model = AutoModelForSequenceClassification.from_pretrained(
+                model_name,
+                low_cpu_mem_usage=True
+            )
+            self.model.to(self.device)
+            if use_int8 is None:
+                use_int8 = self.device.type == 'cpu'
+            self.use_int8 = use_int8 and self.device.type == 'cpu'
+            # Autocast precision: FP16 uses tensor cores on CUDA, BF16 hits
+            # the oneDNN fastpath on modern CPUs. Token ids stay int64 either way.
+            self._autocast_dtype = torch.float16 if self.device.type == 'cuda' else torch.bfloat16
+            self._autocast_enabled = not self.use_int8
+            if self.use_int8:
+                # Dynamic INT8: Linear weights are quantized once, activations
+                # on the fly per batch. Activations stay fp32, so the reduced-
+                # precision cast (and autocast) is skipped on this path.
+                self.dtype = torch.float32
+                self.model.eval()
+                self.model = torch.quantization.quantize_dynamic(
+                    self.model, {torch.nn.Linear}, dtype=torch.qint8
+                )
+                print("Using dynamic INT8 quantization for CPU inference")
+            else:
+                self.dtype = self._autocast_dtype
+                self.model = self.model.to(self.dtype)
+                self.model.eval()
+            if self.device.type == 'cpu':
+                # Many deployments default to a single intra-op thread
+                torch.set_num_threads(os.cpu_count() or 1)
+                try:
+                    torch.set_num_interop_threads(max(1, (os.cpu_count() or 1) // 4))
+                except RuntimeError:
+                    pass  # interop pool already started; keep the default
+                if IPEX_AVAILABLE and not self.use_int8:
+                    self.model = ipex.optimize(self.model, dtype=self.dtype)
+                    print("Using intel_extension_for_pytorch optimized model")
+            # Compile for repeated single-batch inference; fall back to eager
+            # for any ops Inductor can't capture
+            try:
+                torch._dynamo.config.suppress_errors = True
+                self.model = torch.compile(self.model, mode="reduce-overhead", fullgraph=False)
+                self._warmup()
+            except Exception as e:
+                print(f"torch.compile unavailable, trying TorchScript freeze: {e}")
+                # Lighter-weight fusion path: trace + optimize_for_inference
+                # fuses LayerNorm/GEMM and constant-folds eval-mode branches
+                try:
+                    example_ids = torch.ones((1, 16), dtype=torch.long, device=self.device)
+                    example_mask = torch.ones_like(example_ids)
+                    traced = torch.jit.trace(self.model, (example_ids, example_mask), strict=False)
+                    self.model = torch.jit.optimize_for_inference(traced)
+                except Exception as e:
+                    print(f"TorchScript freeze failed, using eager mode: {e}")
+            if self.device.type == 'cuda':
+                # Pinned staging buffers: host->device copies from pinned
+                # memory are faster and can overlap on a side stream
+                self._pinned_ids = torch.empty((1, 512), dtype=torch.long, pin_memory=True)
+                self._pinned_mask = torch.empty((1, 512), dtype=torch.long, pin_memory=True)
+                self._copy_stream = torch.cuda.Stream()
+
+
+        self.model_labels = ['joy', 'sadness', 'anger', 'fear', 'surprise', 'disgust']
+
+        # Precomputed label->emotion mapping matrices for the no-context path:
+        # one matmul replaces the per-label Python loop. The second matrix
+        # covers the anger->frustration redirect ('tired' etc. in the text).
+        self._map_matrix = self._build_map_matrix(anger_as_frustration=False)
+        self._map_matrix_frustrated = self._build_map_matrix(anger_as_frustration=True)
+        if not self.use_onnx:
+            # Device-resident copies so aggregation fuses with the forward and
+            # only the final 6-vector crosses back to the host
+            self._map_matrix_t = torch.from_numpy(self._map_matrix).to(self.device)
+            self._map_matrix_frustrated_t = torch.from_numpy(self._map_matrix_frustrated).to(self.device)
+
+        # Memoize the full tokenize + forward + map pipeline per normalized
+        # text — chat traffic repeats canned phrases, so hits skip the model
+        self._cached_probabilities = functools.lru_cache(maxsize=cache_size)(
+            self._compute_probabilities
+        )
+
+        # Observability: how often the anchor fast path skipped the model
+        self.fast_path_hits = 0
+
+        print("Emotion Detection Agent initialized!")
+
+    @property
+    def cache_stats(self):
+        """Hit/miss counters for the memoized inference path."""
+        info = self._cached_probabilities.cache_info()
+        return {'hits': info.hits, 'misses': info.misses, 'size': info.currsize}
+
+    def _load_onnx_model(self, model_name):
+        """Export the model to ONNX and apply INT8 dynamic quantization (cached on disk)."""
+        cache_dir = os.path.expanduser('~/.cache/emotion_agent/onnx-int8')
+        quantized_file = 'model_quantized.onnx'
+
+        if not os.path.exists(os.path.join(cache_dir, quantized_file)):
+            print("Exporting model to ONNX and quantizing to INT8 (one-time)...")
+            exported = ORTModelForSequenceClassification.from_pretrained(model_name, export=True)
+            exported.save_pretrained(cache_dir)
+
+            # Dynamic INT8 quantization so MatMul/Gemm run on int8 kernels
+            quantizer = ORTQuantizer.from_pretrained(cache_dir)
+            quantization_config = AutoQuantizationConfig.avx512_vnni(is_static=False, per_channel=False)
+            quantizer.quantize(save_dir=cache_dir, quantization_config=quantization_config)
+
+        # Graph-level optimizations (attention fusion, constant folding) plus
+        # full intra-op threading; the default session only enables BASIC
+        sess_options = ort.SessionOptions()
+        sess_options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        sess_options.intra_op_num_threads = os.cpu_count() or 1
+
+        return ORTModelForSequenceClassification.from_pretrained(
+            cache_dir,
+            file_name=quantized_file,
+            session_options=sess_options
+        )
+
+    def _build_map_matrix(self, anger_as_frustration=False):
+        """Build the (model_labels x EMOTIONS) assignment matrix for fallback mapping."""
+        # Note: the old surprise->happiness branch only fired on words that the
+        # happiness context bucket already catches, so it never reached here.
+        fallback = {
+            'joy': 'happiness',
+            'sadness': 'sadness',
+            'anger': 'frustration' if anger_as_frustration else 'anger',
+            'fear': 'anxiety',
+            'surprise': 'anxiety',
+            'disgust': 'anger',
+        }
+        matrix = np.zeros((len(self.model_labels), len(self.EMOTIONS)), dtype=np.float32)
+        for row, label in enumerate(self.model_labels):
+            matrix[row, self.EMOTIONS.index(fallback[label])] = 1.0
+        return matrix
+
+    def _warmup(self):
+        """Run a dummy forward so compilation cost is paid at init, not on the first user call."""
+        dummy = self.tokenizer(
+            "warm up",
+            return_tensors="pt",
+            truncation=True,
+            max_length=512,
+            padding=False
+        ).to(self.device)
+        with torch.inference_mode(), torch.autocast(device_type=self.device.type, dtype=self._autocast_dtype, enabled=self._autocast_enabled):
+            self.model(dummy['input_ids'], dummy['attention_mask'])
+    
+    def predict_emotion(self, text: str) -> tuple:
+        """
+        Predict emotion from text with improved accuracy.
+        Returns top emotion and confidence.
+        
+        Args:
+            text: Input text string
+            
+        Returns:
+            tuple: (emotion_label, confidence_score)
+        """
+        all_probs = self.get_all_probabilities(text)
+        emotion_label = max(all_probs, key=all_probs.get)
+        confidence_score = all_probs[emotion_label]
+        return emotion_label, confidence_score
+    
+    def get_top_emotions(self, text: str, top_n: int = 3) -> list:
+        """
+        Get top N emotions with their probabilities.
+        
+        Args:
+            text: Input text string
+            top_n: Number of top emotions to return
+            
+        Returns:
+            List of tuples: [(emotion, probability), ...] sorted by probability
+        """
+        all_probs = self.get_all_probabilities(text)
+        sorted_emotions = sorted(all_probs.items(), key=lambda x: x[1], reverse=True)
+        return sorted_emotions[:top_n]
+
+    def classify(self, text: str, top_n: int = 3) -> tuple:
+        """
+        Classify text in one pass: (top emotion, its confidence, top-N list).
+
+        Tokenizes and forwards once (through the memoized probability cache)
+        and derives both the primary emotion and the breakdown from the same
+        distribution, instead of paying predict_emotion + get_top_emotions
+        separately.
+
+        Args:
+            text: Input text string
+            top_n: Number of top emotions to include in the breakdown
+
+        Returns:
+            tuple: (emotion_label, confidence_score, [(emotion, probability), ...])
+        """
+        all_probs = self.get_all_probabilities(text)
+        top = sorted(all_probs.items(), key=lambda x: x[1], reverse=True)[:top_n]
+        emotion_label, confidence_score = top[0]
+        return emotion_label, confidence_score, top
+
+    def predict_emotions_batch(self, texts: list, batch_size: int = 64) -> list:
+        """
+        Predict emotions for many texts at once (batch processing).
+
+        Inputs are sorted by token length before batching so each forward
+        pass wastes as little work as possible on padding.
+
+        Args:
+            texts: List of text strings
+            batch_size: Number of texts per forward pass
+
+        Returns:
+            List of (emotion_label, confidence_score) tuples in input order
+        """
+        if not texts:
+            raise ValueError("Texts list cannot be empty")
+
+        # Length-sorted bucketing: group similar-length texts together
+        order = sorted(range(len(texts)), key=lambda i: len(self.tokenizer.tokenize(texts[i])))
+        results = [None] * len(texts)
+
+        for start in range(0, len(order), batch_size):
+            chunk = order[start:start + batch_size]
+            inputs = self.tokenizer(
+                [texts[i] for i in chunk],
+                return_tensors="pt",
+                truncation=True,
+                max_length=512,
+                padding=True
+            )
+
+            if self.use_onnx:
+                outputs = self.model(inputs['input_ids'], inputs['attention_mask'])
+                probabilities = torch.softmax(outputs['logits'], dim=1)
+            else:
+                inputs = inputs.to(self.device)
+                with torch.inference_mode(), torch.autocast(device_type=self.device.type, dtype=self._autocast_dtype, enabled=self._autocast_enabled):
+                    outputs = self.model(inputs['input_ids'], inputs['attention_mask'])
+                    probabilities = torch.softmax(outputs['logits'], dim=1)
+
+            # Scatter results back to the caller's order
+            for row, i in enumerate(chunk):
+                scores = dict(self._postprocess_row(probabilities[row].tolist(), texts[i].lower()))
+                emotion_label = max(scores, key=scores.get)
+                results[i] = (emotion_label, scores[emotion_label])
+
+        return results
+    
+    def get_all_probabilities(self, text: str) -> dict:
+        """Get probability scores for all emotions with improved accuracy."""
+        if not text or not text.strip():
+            raise ValueError("Text cannot be empty")
+
+        # Normalize whitespace so trivially-edited duplicates hit the cache;
+        # case is preserved because the model is case-sensitive
+        key = ' '.join(text.split())
+        return dict(self._cached_probabilities(key))
+
+    def _compute_probabilities(self, text: str) -> tuple:
+        """Uncached inference path; returns emotion/probability pairs as a hashable tuple."""
+        text_lower = text.lower()
+
+        # Fast path: if the winning context bucket contains an unambiguous
+        # anchor ("I'm depressed", "so furious"), skip the transformer — the
+        # context match fully determines the output either way
+        context = self._detect_context(text_lower)
+        if context is not None and _FAST_PATH_ANCHORS[context].search(text_lower):
+            self.fast_path_hits += 1
+            return tuple((e, 1.0 if e == context else 0.0) for e in self.EMOTIONS)
+
+        # Tokenize and predict
+        # padding is pointless for a single sequence (mask would be all 1s)
+        inputs = self.tokenizer(
+            text,
+            return_tensors="pt",
+            truncation=True,
+            max_length=512,
+            padding=False
+        )
+
+        if self.use_onnx:
+            # ORT session runs on CPU; optimum accepts torch tensors directly
+            outputs = self.model(inputs['input_ids'], inputs['attention_mask'])
+            probabilities = torch.softmax(outputs['logits'], dim=1)
+            return self._postprocess_row(probabilities[0].tolist(), text_lower)
+
+        if self.device.type == 'cuda':
+            # Stage through pinned memory and copy on a side stream so
+            # the host->device transfer overlaps instead of blocking
+            length = inputs['input_ids'].shape[1]
+            self._pinned_ids[0, :length].copy_(inputs['input_ids'][0])
+            self._pinned_mask[0, :length].copy_(inputs['attention_mask'][0])
+            with torch.cuda.stream(self._copy_stream):
+                input_ids = self._pinned_ids[:, :length].to(self.device, non_blocking=True)
+                attention_mask = self._pinned_mask[:, :length].to(self.device, non_blocking=True)
+            torch.cuda.current_stream().wait_stream(self._copy_stream)
+        else:
+            inputs = inputs.to(self.device)
+            input_ids = inputs['input_ids']
+            attention_mask = inputs['attention_mask']
+        with torch.inference_mode(), torch.autocast(device_type=self.device.type, dtype=self._autocast_dtype, enabled=self._autocast_enabled):
+            outputs = self.model(input_ids, attention_mask)
+
+        return self._postprocess_logits(outputs['logits'], text_lower)
+
+    def _detect_context(self, text_lower: str):
+        """Return the context emotion for the text, or None if no bucket matches."""
+        for emotion, pattern in _CONTEXT_PATTERNS:
+            if pattern.search(text_lower):
+                return emotion
+        return None
+
+    def _postprocess_logits(self, logits, text_lower: str) -> tuple:
+        """
+        Torch-path postprocessing: softmax, bucket matmul and normalization
+        all stay on device, with a single device->host copy at the end.
+        """
+        context = self._detect_context(text_lower)
+        if context is not None:
+            return tuple((e, 1.0 if e == context else 0.0) for e in self.EMOTIONS)
+
+        if _ANGER_AS_FRUSTRATION.search(text_lower):
+            matrix = self._map_matrix_frustrated_t
+        else:
+            matrix = self._map_matrix_t
+
+        probs = logits.softmax(-1)[0, :len(self.model_labels)].to(matrix.dtype)
+        agg = probs @ matrix
+        counts = matrix.sum(dim=0)
+        means = torch.where(counts > 0, agg / counts, torch.zeros_like(agg))
+        # clamp_min instead of an if: avoids an extra device->host sync and
+        # still yields all-zeros when the total is zero
+        means = means / means.sum().clamp_min(1e-12)
+
+        return tuple(zip(self.EMOTIONS, means.cpu().tolist()))
+
+    def _postprocess_row(self, probs_list: list, text_lower: str) -> tuple:
+        """
+        Map one row of model probabilities to normalized standard-emotion scores.
+
+        Callers pass the already-lowercased text so case-folding happens
+        exactly once per input.
+        """
+        # A context match collapses all probability mass onto one emotion
+        context = self._detect_context(text_lower)
+        if context is not None:
+            return tuple((e, 1.0 if e == context else 0.0) for e in self.EMOTIONS)
+
+        # No context: one matmul aggregates model-label probabilities into
+        # standard-emotion buckets, then we average per bucket and normalize
+        if _ANGER_AS_FRUSTRATION.search(text_lower):
+            matrix = self._map_matrix_frustrated
+        else:
+            matrix = self._map_matrix
+
+        probs = np.asarray(probs_list[:len(self.model_labels)], dtype=np.float32)
+        agg = probs @ matrix
+        counts = matrix.sum(axis=0)
+        means = np.divide(agg, counts, out=np.zeros_like(agg), where=counts > 0)
+
+        total = means.sum()
+        if total > 0:
+            means = means / total
+
+        return tuple(zip(self.EMOTIONS, means.tolist()))
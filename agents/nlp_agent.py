@@ -1,114 +1,262 @@
-"""
-Converts user text into numerical embeddings using Voyage AI API.
-"""
-
-import numpy as np
-import os
-import requests
-
-try:
-    from config import VOYAGE_API_KEY, VOYAGE_API_URL, VOYAGE_MODEL
-except ImportError:
-    VOYAGE_API_KEY = None
-    VOYAGE_API_URL = "https://api.voyageai.com/v1/embeddings"
-    VOYAGE_MODEL = "voyage-lite-02-instruct"
-
-
-class NLPAgent:
-    
-    def __init__(self, api_key=None):
-        """
-        Initialize the Voyage AI embedding model.
-        
-        Args:
-            api_key: Voyage AI API key (or set in config.py, or VOYAGE_API_KEY environment variable)
-        """
-        print("Initializing NLP Agent (Voyage AI API)...")
-        
-        # Priority: passed parameter > config.py > environment variable
-        self.api_key = api_key or VOYAGE_API_KEY or os.getenv('VOYAGE_API_KEY')
-        if not self.api_key:
-            raise ValueError(
-                "Voyage API key not found. Please:\n"
-                "1. Set VOYAGE_API_KEY in config.py, or\n"
-                "2. Set VOYAGE_API_KEY environment variable, or\n"
-                "3. Pass api_key parameter"
-            )
-        
-        self.model_name = VOYAGE_MODEL
-        self.api_url = VOYAGE_API_URL
-        self.headers = {
-            "Authorization": f"Bearer {self.api_key}",
-            "Content-Type": "application/json"
-        }
-        
-        print("NLP Agent initialized successfully!")
-    
-    def generate_embedding(self, text: str) -> np.ndarray:
-        """
-        Convert text to embedding vector using Voyage AI API.
-        
-        Args:
-            text: Input text string
-            
-        Returns:
-            numpy array containing the embedding
-        """
-        if not text or not text.strip():
-            raise ValueError("Text cannot be empty")
-        
-        # Call Voyage AI API
-        payload = {
-            "model": self.model_name,
-            "input": [text]
-        }
-        
-        response = requests.post(
-            self.api_url,
-            headers=self.headers,
-            json=payload,
-            timeout=30
-        )
-        
-        if response.status_code != 200:
-            raise Exception(f"Voyage API error: {response.status_code} - {response.text}")
-        
-        data = response.json()
-        embedding = np.array(data['data'][0]['embedding'])
-        
-        return embedding
-    
-    def generate_embeddings_batch(self, texts: list) -> np.ndarray:
-        """
-        Convert multiple texts to embeddings (batch processing).
-        
-        Args:
-            texts: List of text strings
-            
-        Returns:
-            numpy array of shape (batch_size, embedding_dim) containing embeddings
-        """
-        if not texts:
-            raise ValueError("Texts list cannot be empty")
-        
-        # Call Voyage AI API
-        payload = {
-            "model": self.model_name,
-            "input": texts
-        }
-        
-        response = requests.post(
-            self.api_url,
-            headers=self.headers,
-            json=payload,
-            timeout=30
-        )
-        
-        if response.status_code != 200:
-            raise Exception(f"Voyage API error: {response.status_code} - {response.text}")
-        
-        data = response.json()
-        embeddings = np.array([item['embedding'] for item in data['data']])
-        
-        return embeddings
-
+"""
+Converts user text into numerical embeddings using Voyage AI API.
+"""
+
+import hashlib
+import numpy as np
+import os
+import random
+import requests
+import time
+
+# Optional: orjson decodes large embedding arrays ~3x faster than stdlib json
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    from config import VOYAGE_API_KEY, VOYAGE_API_URL, VOYAGE_MODEL
+except ImportError:
+    VOYAGE_API_KEY = None
+    VOYAGE_API_URL = "https://api.voyageai.com/v1/embeddings"
+    VOYAGE_MODEL = "voyage-lite-02-instruct"
+
+
+class NLPAgent:
+    
+    def __init__(self, api_key=None, cache_dir='~/.cache/nlp_agent', precision='fp16'):
+        """
+        Initialize the Voyage AI embedding model.
+
+        Args:
+            api_key: Voyage AI API key (or set in config.py, or VOYAGE_API_KEY environment variable)
+            cache_dir: Directory for the on-disk embedding cache (None disables caching)
+            precision: Cached embedding storage format, 'fp16' or 'int8'
+        """
+        if precision not in ('fp16', 'int8'):
+            raise ValueError("precision must be 'fp16' or 'int8'")
+        self.precision = precision
+
+        print("Initializing NLP Agent (Voyage AI API)...")
+        
+        # Priority: passed parameter > config.py > environment variable
+        self.api_key = api_key or VOYAGE_API_KEY or os.getenv('VOYAGE_API_KEY')
+        if not self.api_key:
+            raise ValueError(
+                "Voyage API key not found. Please:\n"
+                "1. Set VOYAGE_API_KEY in config.py, or\n"
+                "2. Set VOYAGE_API_KEY environment variable, or\n"
+                "3. Pass api_key parameter"
+            )
+        
+        self.model_name = VOYAGE_MODEL
+        self.api_url = VOYAGE_API_URL
+        self.headers = {
+            "Authorization": f"Bearer {self.api_key}",
+            "Content-Type": "application/json"
+        }
+
+        # Pooled session so repeated calls reuse TCP + TLS connections
+        self.session = requests.Session()
+        self.session.headers.update(self.headers)
+        adapter = requests.adapters.HTTPAdapter(pool_connections=16, pool_maxsize=16)
+        self.session.mount('https://', adapter)
+
+        # On-disk embedding cache: identical inputs skip the API call (and
+        # its cost) entirely. Keyed by model name + SHA-256 of the text.
+        self.cache_dir = os.path.expanduser(cache_dir) if cache_dir else None
+        if self.cache_dir:
+            os.makedirs(self.cache_dir, exist_ok=True)
+
+        print("NLP Agent initialized successfully!")
+
+    def _cache_path(self, text: str) -> str:
+        """Cache file path for a text (model- and precision-versioned)."""
+        digest = hashlib.sha256(text.encode('utf-8')).hexdigest()
+        ext = 'npz' if self.precision == 'int8' else 'npy'
+        return os.path.join(self.cache_dir, f"{self.model_name}-{digest}.{self.precision}.{ext}")
+
+    def _cache_get(self, text: str):
+        """Return the cached embedding for text, or None on a miss."""
+        if not self.cache_dir:
+            return None
+        path = self._cache_path(text)
+        if not os.path.exists(path):
+            return None
+        try:
+            if self.precision == 'int8':
+                with np.load(path) as data:
+                    return data['q'].astype(np.float32) * (float(data['scale']) / 127.0)
+            return np.load(path).astype(np.float32)
+        except (OSError, ValueError):
+            return None
+
+    def _cache_put(self, text: str, embedding: np.ndarray):
+        """Store an embedding on disk in reduced precision (fp16 2x, int8 ~4x smaller)."""
+        if not self.cache_dir:
+            return
+        try:
+            if self.precision == 'int8':
+                # Per-vector abs-max calibration; cosine use downstream is
+                # insensitive to the small rounding error
+                scale = float(np.max(np.abs(embedding))) or 1.0
+                quantized = np.round(embedding / scale * 127.0).astype(np.int8)
+                np.savez(self._cache_path(text), scale=np.float16(scale), q=quantized)
+            else:
+                np.save(self._cache_path(text), embedding.astype(np.float16))
+        except OSError:
+            pass  # cache is best-effort; never fail the request over it
+    
+    def _post_with_retry(self, payload: dict, max_attempts: int = 5):
+        """POST to the Voyage API, retrying transient failures with exponential backoff."""
+        delay = 1.0
+        for attempt in range(1, max_attempts + 1):
+            try:
+                response = self.session.post(self.api_url, json=payload, timeout=30)
+            except (requests.Timeout, requests.ConnectionError):
+                if attempt == max_attempts:
+                    raise
+            else:
+                if response.status_code == 200:
+                    return response
+                # Retry rate limits and server errors; fail fast on everything else
+                if response.status_code not in (429, 500, 502, 503, 504) or attempt == max_attempts:
+                    raise Exception(f"Voyage API error: {response.status_code} - {response.text}")
+                retry_after = response.headers.get('Retry-After')
+                if retry_after:
+                    try:
+                        delay = max(delay, float(retry_after))
+                    except ValueError:
+                        pass
+            # Exponential backoff with jitter, capped at 30s
+            time.sleep(min(delay + random.uniform(0, delay), 30))
+            delay = min(delay * 2, 30)
+
+    @staticmethod
+    def _parse_json(response) -> dict:
+        """Decode a response body, preferring orjson when installed."""
+        if orjson is not None:
+            return orjson.loads(response.content)
+        return response.json()
+
+    def generate_embedding(self, text: str) -> np.ndarray:
+        """
+        Convert text to embedding vector using Voyage AI API.
+        
+        Args:
+            text: Input text string
+            
+        Returns:
+            numpy array containing the embedding
+        """
+        if not text or not text.strip():
+            raise ValueError("Text cannot be empty")
+
+        cached = self._cache_get(text)
+        if cached is not None:
+            return cached
+
+        # Call Voyage AI API
+        payload = {
+            "model": self.model_name,
+            "input": [text]
+        }
+
+        response = self._post_with_retry(payload)
+        data = self._parse_json(response)
+        embedding = np.array(data['data'][0]['embedding'])
+        self._cache_put(text, embedding)
+
+        return embedding
+    
+    def generate_embeddings_batch(self, texts: list) -> np.ndarray:
+        """
+        Convert multiple texts to embeddings (batch processing).
+        
+        Args:
+            texts: List of text strings
+            
+        Returns:
+            numpy array of shape (batch_size, embedding_dim) containing embeddings
+        """
+        if not texts:
+            raise ValueError("Texts list cannot be empty")
+
+        # Serve what we can from the cache and only request the misses
+        embeddings = [self._cache_get(text) for text in texts]
+        miss_indices = [i for i, emb in enumerate(embeddings) if emb is None]
+
+        if miss_indices:
+            # Call Voyage AI API
+            payload = {
+                "model": self.model_name,
+                "input": [texts[i] for i in miss_indices]
+            }
+
+            response = self._post_with_retry(payload)
+            data = self._parse_json(response)
+
+            # Decode straight into a preallocated float32 buffer: NumPy
+            # bulk-copies each row in C instead of building N temporary lists
+            items = data['data']
+            decoded = np.empty((len(items), len(items[0]['embedding'])), dtype=np.float32)
+            for row, item in enumerate(items):
+                decoded[row] = item['embedding']
+
+            for row, i in enumerate(miss_indices):
+                self._cache_put(texts[i], decoded[row])
+                embeddings[i] = decoded[row]
+
+        return np.array(embeddings)
+
+    async def generate_embeddings_async(self, texts: list, max_batch_size: int = 128) -> np.ndarray:
+        """
+        Convert texts to embeddings with concurrent batched API calls.
+
+        Splits texts into provider-sized sublists and issues the requests
+        concurrently over one pooled aiohttp session.
+
+        Args:
+            texts: List of text strings
+            max_batch_size: Maximum inputs per API request
+
+        Returns:
+            numpy array of shape (len(texts), embedding_dim) containing embeddings
+        """
+        if not texts:
+            raise ValueError("Texts list cannot be empty")
+
+        import asyncio
+        import aiohttp
+
+        chunks = [texts[i:i + max_batch_size] for i in range(0, len(texts), max_batch_size)]
+
+        async with aiohttp.ClientSession(headers=self.headers) as session:
+            async def fetch(chunk):
+                payload = {
+                    "model": self.model_name,
+                    "input": chunk
+                }
+                async with session.post(
+                    self.api_url,
+                    json=payload,
+                    timeout=aiohttp.ClientTimeout(total=30)
+                ) as response:
+                    if response.status != 200:
+                        raise Exception(f"Voyage API error: {response.status} - {await response.text()}")
+                    data = await response.json()
+                    return [item['embedding'] for item in data['data']]
+
+            results = await asyncio.gather(*(fetch(chunk) for chunk in chunks))
+
+        # Same preallocated-buffer fill as the sync batch path
+        embeddings = np.empty((len(texts), len(results[0][0])), dtype=np.float32)
+        row = 0
+        for chunk in results:
+            for emb in chunk:
+                embeddings[row] = emb
+                row += 1
+
+        return embeddings
+
@@ -3,13 +3,14 @@ Streamlit App - Emotion Detection and Support System
 Main application that integrates all three agents in a conversational format.
 """
 
+import asyncio
+import threading
+import time
+from collections import Counter, deque
+
 import streamlit as st
-import numpy as np
-import os
-from datetime import datetime
 from agents.nlp_agent import NLPAgent
 from agents.emotion_agent import EmotionAgent
-from agents.suggestion_agent import SuggestionAgent
 
 # Page configuration
 st.set_page_config(
@@ -19,8 +20,13 @@ st.set_page_config(
     initial_sidebar_state="collapsed"
 )
 
-# Custom CSS for chat interface
-st.markdown("""
+# config.py ships with the app and already resolves environment variables
+# itself, so import it directly - no try/except ImportError guard needed
+from config import VOYAGE_API_KEY, TOGETHER_API_KEY
+
+# Custom CSS for chat interface (constant; Streamlit re-emits it each rerun
+# because styles from prior runs are cleared with their elements)
+_PAGE_CSS = """
     <style>
     .main-header {
         font-size: 2.5rem;
@@ -55,7 +61,9 @@ st.markdown("""
         margin-bottom: 1rem;
     }
     </style>
-""", unsafe_allow_html=True)
+"""
+
+st.markdown(_PAGE_CSS, unsafe_allow_html=True)
 
 # Emotion emoji mapping
 EMOTION_EMOJIS = {
@@ -75,9 +83,15 @@ if 'emotion_agent' not in st.session_state:
 if 'suggestion_agent' not in st.session_state:
     st.session_state.suggestion_agent = None
 if 'chat_history' not in st.session_state:
-    st.session_state.chat_history = []
+    # Bounded deque: O(1) appends with a hard memory ceiling; the oldest
+    # messages silently age out past 500
+    st.session_state.chat_history = deque(maxlen=500)
 if 'conversation_started' not in st.session_state:
     st.session_state.conversation_started = False
+if 'render_window' not in st.session_state:
+    st.session_state.render_window = 50
+if 'emotion_counts' not in st.session_state:
+    st.session_state.emotion_counts = Counter()
 
 
 @st.cache_resource
@@ -88,24 +102,164 @@ def load_nlp_agent(api_key=None):
 @st.cache_resource
 def load_emotion_agent():
     """Load emotion agent (cached to avoid reloading)."""
-    return EmotionAgent()
+    agent = EmotionAgent()
+    # One throwaway inference inside the load spinner: triggers any lazy
+    # compile/optimize work now instead of on the user's first message
+    try:
+        agent.predict_emotion("warming up the model")
+    except Exception:
+        pass
+    return agent
 
 @st.cache_resource
 def load_suggestion_agent(api_key=None, use_together=True):
     """Load suggestion agent (cached to avoid reloading)."""
+    # Imported here, not at module top: this module is only needed once the
+    # lazy loader actually fires, so cold starts skip its import cost
+    from agents.suggestion_agent import SuggestionAgent
     return SuggestionAgent(api_key=api_key, use_together=use_together)
 
 
-def generate_therapist_response(user_message, emotion, confidence, suggestion_agent, conversation_history):
-    """Generate a contextual therapist-like response based on user's actual message."""
-    # Generate response based ONLY on the conversation
-    response = suggestion_agent.generate_response(
-        user_message=user_message,
-        emotion=emotion,
-        conversation_history=conversation_history
-    )
+@st.cache_data(show_spinner=False, max_entries=256)
+def _classify(_agent, text: str):
+    """
+    Classify a message once: (top emotion, its confidence, top-3 list).
+
+    EmotionAgent.classify runs one model forward for both outputs, and
+    st.cache_data makes repeated inputs and Streamlit reruns free. _agent
+    is underscore-prefixed so Streamlit skips hashing the model object.
+    """
+    return _agent.classify(text, top_n=3)
+
+
+def _build_ctx(history, max_chars=4000, max_msgs=16):
+    """
+    Build the LLM context from recent history under a size budget.
+
+    Walks the newest max_msgs messages backwards, accumulating until the
+    character budget is spent, then restores chronological order - so the
+    prompt is bounded in both message count and characters no matter how
+    long the session runs.
+    """
+    ctx = []
+    used = 0
+    # history may be a deque, which doesn't slice; the copy is bounded by
+    # the deque's maxlen
+    for msg in reversed(list(history)[-max_msgs:]):
+        content = msg.get('content', '').strip()
+        if not content:
+            continue
+        used += len(content)
+        if ctx and used > max_chars:
+            break
+        ctx.append({'role': msg.get('role', 'user'), 'content': content})
+    ctx.reverse()
+    return ctx
+
+
+async def _process_turn(emotion_agent, user_input, together_api_key, suggestion_agent):
+    """
+    Run the per-turn model work concurrently.
+
+    Emotion classification and (on the first message) the suggestion-agent
+    load overlap in worker threads instead of running serially before the
+    LLM call.
+    """
+    tasks = [asyncio.to_thread(_classify, emotion_agent, user_input)]
+    if suggestion_agent is None:
+        tasks.append(asyncio.to_thread(load_suggestion_agent, together_api_key, True))
+
+    results = await asyncio.gather(*tasks)
+    emotion, confidence, top_emotions = results[0]
+    if suggestion_agent is None:
+        suggestion_agent = results[1]
+    return emotion, confidence, top_emotions, suggestion_agent
+
+
+@st.fragment
+def _render_history():
+    """
+    Render the chat history (its own fragment, so interactions elsewhere on
+    the page don't re-run this loop).
+
+    Only the most recent window is rendered; older messages stay collapsed
+    behind the button so rerun cost stays bounded on long sessions.
+    """
+    history = st.session_state.chat_history
+    window = st.session_state.render_window
+    if len(history) > window:
+        if st.button(f"⬆️ Load earlier messages ({len(history) - window} hidden)"):
+            st.session_state.render_window = window + 50
+            st.rerun(scope="fragment")
+
+    for msg in list(history)[-window:]:
+        role = msg['role']
+        content = msg['content']
+        if role == 'user':
+            with st.chat_message("user"):
+                st.write(content)
+        else:
+            with st.chat_message("assistant"):
+                # Badges and the secondary-emotions line are precomputed when
+                # the message is appended, so reruns just emit them
+                if msg.get('badge_html'):
+                    st.markdown(msg['badge_html'], unsafe_allow_html=True)
+                if msg.get('others_text'):
+                    st.markdown(
+                        f'<div style="font-size: 0.75rem; color: #666; margin-top: 0.25rem;">Also detected: {msg["others_text"]}</div>',
+                        unsafe_allow_html=True
+                    )
+                st.write(content)
+
+
+@st.fragment
+def _render_about():
+    """Static sidebar copy; a separate fragment so it never reruns with the stats."""
+    st.markdown("### 💡 About This Chat")
+    st.markdown("""
+    This is an AI-powered support chat that:
+    - Detects emotions in your messages
+    - Provides supportive, non-medical suggestions
+    - Maintains conversation context
+    
+    **Important**: This is not a replacement for professional mental health care.
+    """)
+    
+    st.markdown("---")
+    st.markdown("### 🔑 API Keys")
+    st.markdown("""
+    **For developers:** API keys are loaded from:
+    - Environment variables (recommended for production)
+    - `config.py` file (for local development)
     
-    return response
+    **Streamlit Cloud:** Add keys in Settings → Secrets
+    
+    The app works without API keys using enhanced fallback responses.
+    """)
+    
+    st.markdown("---")
+
+
+@st.fragment
+def _render_sidebar():
+    """Dynamic sidebar content (stats, controls); reruns independently."""
+    if st.button("🗑️ Clear Chat History", use_container_width=True):
+        st.session_state.chat_history = deque(maxlen=500)
+        st.session_state.emotion_counts = Counter()
+        st.session_state.conversation_started = False
+        st.rerun()
+    
+    st.markdown("---")
+    st.markdown("### 📊 Session Stats")
+    st.metric("Messages", len(st.session_state.chat_history))
+    
+    # Show emotion distribution (tally maintained incrementally as
+    # messages are appended, so reruns don't rescan the history)
+    if st.session_state.emotion_counts:
+        st.markdown("**Emotions Detected:**")
+        for emo, count in st.session_state.emotion_counts.most_common():
+            emoji = EMOTION_EMOJIS.get(emo, '💭')
+            st.markdown(f"{emoji} {emo.capitalize()}: {count}")
 
 
 def main():
@@ -123,21 +277,22 @@ def main():
     # Load essential agents first (fast loading)
     if st.session_state.nlp_agent is None:
         with st.spinner("Loading AI agents... This should be quick!"):
-            # Get API keys: priority = session state > config.py > environment variable
-            try:
-                from config import VOYAGE_API_KEY as config_voyage_key
-            except ImportError:
-                config_voyage_key = None
-            
-            voyage_api_key = (
-                config_voyage_key or 
-                os.getenv('VOYAGE_API_KEY')
-            )
-            st.session_state.nlp_agent = load_nlp_agent(api_key=voyage_api_key)
+            st.session_state.nlp_agent = load_nlp_agent(api_key=VOYAGE_API_KEY)
             st.session_state.emotion_agent = load_emotion_agent()
     
     nlp_agent = st.session_state.nlp_agent
     emotion_agent = st.session_state.emotion_agent
+
+    # Warm the suggestion agent in the background so the first message does
+    # not pay its construction cost; load_suggestion_agent is cached, so the
+    # later foreground call becomes a lookup
+    if not st.session_state.get('suggestion_preload_started'):
+        st.session_state.suggestion_preload_started = True
+        threading.Thread(
+            target=load_suggestion_agent,
+            kwargs={'api_key': TOGETHER_API_KEY, 'use_together': True},
+            daemon=True
+        ).start()
     
     # Welcome message
     if not st.session_state.conversation_started:
@@ -146,47 +301,12 @@ def main():
             'content': "Hello! I'm here to listen and provide support. Feel free to share what's on your mind. So, tell me about your day.",
             'emotion': None,
             'confidence': None,
-            'timestamp': datetime.now()
+            'ts_ns': time.time_ns()
         }
         st.session_state.chat_history.append(welcome_msg)
         st.session_state.conversation_started = True
     
-    # Display chat history using Streamlit's native chat components
-    for msg in st.session_state.chat_history:
-        role = msg['role']
-        content = msg['content']
-        emotion = msg.get('emotion')
-        confidence = msg.get('confidence')
-        top_emotions = msg.get('top_emotions', [])
-        
-        if role == 'user':
-            with st.chat_message("user"):
-                st.write(content)
-        else:
-            with st.chat_message("assistant"):
-                # Show emotion badges if available
-                if emotion:
-                    # Show top emotion prominently
-                    emoji_icon = EMOTION_EMOJIS.get(emotion, '💭')
-                    confidence_text = f" ({confidence:.0%})" if confidence else ""
-                    st.markdown(
-                        f'<div class="emotion-badge">{emoji_icon} Primary: {emotion.capitalize()}{confidence_text}</div>',
-                        unsafe_allow_html=True
-                    )
-                    
-                    # Show other detected emotions if available
-                    if top_emotions and len(top_emotions) > 1:
-                        other_emotions = [e for e in top_emotions if e[0] != emotion][:2]  # Top 2 others
-                        if other_emotions:
-                            other_text = ", ".join([
-                                f"{EMOTION_EMOJIS.get(e[0], '💭')} {e[0].capitalize()} ({e[1]:.0%})"
-                                for e in other_emotions
-                            ])
-                            st.markdown(
-                                f'<div style="font-size: 0.75rem; color: #666; margin-top: 0.25rem;">Also detected: {other_text}</div>',
-                                unsafe_allow_html=True
-                            )
-                st.write(content)
+    _render_history()
     
     # Chat input
     st.markdown("---")
@@ -205,137 +325,95 @@ def main():
     
     # Process user message
     if send_button and user_input and user_input.strip():
-        # Add user message to history
+        # Built up front, but only appended together with the assistant
+        # reply so no rerun can observe a half-finished turn
         user_msg = {
             'role': 'user',
             'content': user_input,
             'emotion': None,
             'confidence': None,
-            'timestamp': datetime.now()
+            'ts_ns': time.time_ns()
         }
-        st.session_state.chat_history.append(user_msg)
         
         # Process the message
-        with st.spinner("Thinking..."):
-            try:
-                # Detect emotion and get top emotions
-                emotion, confidence = emotion_agent.predict_emotion(user_input)
-                top_emotions = emotion_agent.get_top_emotions(user_input, top_n=3)
-                
-                # Load suggestion agent lazily (only when needed)
-                if st.session_state.suggestion_agent is None:
-                    with st.spinner("Loading suggestion model..."):
-                        # Get API keys: priority = session state > config.py > environment variable
-                        try:
-                            from config import TOGETHER_API_KEY as config_together_key
-                        except ImportError:
-                            config_together_key = None
-                        
-                        # Use Together AI (FREE!) for suggestions
-                        together_api_key = (
-                            config_together_key or 
-                            os.getenv('TOGETHER_API_KEY')
-                        )
-                        st.session_state.suggestion_agent = load_suggestion_agent(api_key=together_api_key, use_together=True)
-                
-                suggestion_agent = st.session_state.suggestion_agent
-                
-                # Generate therapist-like response (contextual to conversation)
-                with st.spinner("Crafting a supportive response..."):
-                    # Get conversation history for context (safely handle empty history)
-                    conversation_history = []
-                    if len(st.session_state.chat_history) > 1:
-                        conversation_history = [
-                            {
-                                'role': msg.get('role', 'user'),
-                                'content': msg.get('content', '')
-                            }
-                            for msg in st.session_state.chat_history[:-1]  # Exclude current message
-                            if msg.get('content', '').strip()  # Only include non-empty messages
-                        ]
-                    
-                    response = generate_therapist_response(
+        try:
+            # Detect emotions and load the suggestion agent concurrently
+            with st.spinner("Thinking..."):
+                emotion, confidence, top_emotions, suggestion_agent = asyncio.run(
+                    _process_turn(
+                        emotion_agent,
                         user_input,
-                        emotion,
-                        confidence,
-                        suggestion_agent,
-                        conversation_history
+                        TOGETHER_API_KEY,
+                        st.session_state.suggestion_agent
                     )
-                
-                # Add assistant response to history
-                assistant_msg = {
-                    'role': 'assistant',
-                    'content': response,
-                    'emotion': emotion,
-                    'confidence': confidence,
-                    'top_emotions': top_emotions,
-                    'timestamp': datetime.now()
-                }
-                st.session_state.chat_history.append(assistant_msg)
-                
-                # Rerun to update the chat display
-                st.rerun()
-                
-            except Exception as e:
-                error_msg = {
-                    'role': 'assistant',
-                    'content': f"I apologize, but I encountered an error: {str(e)}. Please try again.",
-                    'emotion': None,
-                    'confidence': None,
-                    'timestamp': datetime.now()
-                }
-                st.session_state.chat_history.append(error_msg)
-                st.rerun()
+                )
+            st.session_state.suggestion_agent = suggestion_agent
+
+            # Context for the LLM, bounded in messages and characters (the
+            # current message is not in history yet)
+            conversation_history = _build_ctx(st.session_state.chat_history)
+
+            # Echo the user's message, then stream the reply token by
+            # token so the first words appear in well under a second
+            # instead of after the full completion
+            with st.chat_message("user"):
+                st.write(user_input)
+            with st.chat_message("assistant"):
+                response = st.write_stream(
+                    suggestion_agent.generate_response_stream(
+                        user_message=user_input,
+                        emotion=emotion,
+                        conversation_history=conversation_history
+                    )
+                )
+            if not isinstance(response, str):
+                response = "".join(response)
+            
+            # Add assistant response to history
+            # Precompute the badge HTML and secondary-emotions line once so
+            # the render loop never re-formats them on later reruns
+            emoji_icon = EMOTION_EMOJIS.get(emotion, '💭')
+            confidence_text = f" ({confidence:.0%})" if confidence else ""
+            others = [e for e in top_emotions if e[0] != emotion][:2]
+            others_text = ", ".join(
+                f"{EMOTION_EMOJIS.get(e[0], '💭')} {e[0].capitalize()} ({e[1]:.0%})"
+                for e in others
+            )
+            assistant_msg = {
+                'role': 'assistant',
+                'content': response,
+                'emotion': emotion,
+                'confidence': confidence,
+                'top_emotions': top_emotions,
+                'badge_html': f'<div class="emotion-badge">{emoji_icon} Primary: {emotion.capitalize()}{confidence_text}</div>',
+                'others_text': others_text,
+                'ts_ns': time.time_ns()
+            }
+            # One extend so no intermediate state is observable, and no
+            # st.rerun(): st.write_stream already painted both messages,
+            # and the history loop picks them up on the next natural rerun
+            st.session_state.chat_history.extend([user_msg, assistant_msg])
+            st.session_state.emotion_counts[emotion] += 1
+            
+        except Exception as e:
+            error_text = f"I apologize, but I encountered an error: {str(e)}. Please try again."
+            with st.chat_message("user"):
+                st.write(user_input)
+            with st.chat_message("assistant"):
+                st.write(error_text)
+            error_msg = {
+                'role': 'assistant',
+                'content': error_text,
+                'emotion': None,
+                'confidence': None,
+                'ts_ns': time.time_ns()
+            }
+            st.session_state.chat_history.extend([user_msg, error_msg])
     
     # Sidebar with options
     with st.sidebar:
-        st.markdown("### 💡 About This Chat")
-        st.markdown("""
-        This is an AI-powered support chat that:
-        - Detects emotions in your messages
-        - Provides supportive, non-medical suggestions
-        - Maintains conversation context
-        
-        **Important**: This is not a replacement for professional mental health care.
-        """)
-        
-        st.markdown("---")
-        st.markdown("### 🔑 API Keys")
-        st.markdown("""
-        **For developers:** API keys are loaded from:
-        - Environment variables (recommended for production)
-        - `config.py` file (for local development)
-        
-        **Streamlit Cloud:** Add keys in Settings → Secrets
-        
-        The app works without API keys using enhanced fallback responses.
-        """)
-        
-        st.markdown("---")
-        
-        if st.button("🗑️ Clear Chat History", use_container_width=True):
-            st.session_state.chat_history = []
-            st.session_state.conversation_started = False
-            st.rerun()
-        
-        st.markdown("---")
-        st.markdown("### 📊 Session Stats")
-        st.metric("Messages", len(st.session_state.chat_history))
-        
-        # Show emotion distribution
-        if len(st.session_state.chat_history) > 1:
-            emotions_detected = [
-                msg.get('emotion') 
-                for msg in st.session_state.chat_history 
-                if msg.get('emotion')
-            ]
-            if emotions_detected:
-                from collections import Counter
-                emotion_counts = Counter(emotions_detected)
-                st.markdown("**Emotions Detected:**")
-                for emo, count in emotion_counts.most_common():
-                    emoji = EMOTION_EMOJIS.get(emo, '💭')
-                    st.markdown(f"{emoji} {emo.capitalize()}: {count}")
+        _render_about()
+        _render_sidebar()
     
     # Footer
     st.markdown("---")